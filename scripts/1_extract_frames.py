@@ -1,10 +1,119 @@
 import cv2
+import itertools
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Downstream steps only read the pixels, so trade file size for encode speed
+PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+# Maximum number of decoded frames waiting to be written
+MAX_PENDING_WRITES = 32
+# Frame intervals of at least this size are skipped with a seek, which lets the
+# decoder restart from the nearest keyframe. Shorter intervals are stepped
+# through with grab(), which still decodes but skips colour conversion and copy
+SEEK_MIN_INTERVAL = 30
+
+class FrameWriter:
+    """
+    Encodes and writes frames on a thread pool so that PNG compression
+    overlaps with decoding. The number of pending frames is bounded to
+    cap memory usage. Failed writes are collected and reported by close().
+    """
+    def __init__(self, max_workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+        self.slots = threading.BoundedSemaphore(MAX_PENDING_WRITES)
+        self.failures = []
+
+    def _write(self, frame_filename, frame):
+        try:
+            if not cv2.imwrite(str(frame_filename), frame, PNG_PARAMS):
+                self.failures.append((frame_filename, "cv2.imwrite returned False"))
+        except Exception as e:
+            self.failures.append((frame_filename, e))
+        finally:
+            self.slots.release()
+
+    def submit(self, frame_filename, frame):
+        self.slots.acquire()
+        self.pool.submit(self._write, frame_filename, frame)
+
+    def close(self):
+        """
+        Waits for all pending writes.
+
+        Raises:
+            OSError: If any frame could not be written.
+        """
+        self.pool.shutdown(wait=True)
+        if self.failures:
+            frame_filename, reason = self.failures[0]
+            raise OSError(f"Failed to write {len(self.failures)} frame(s), "
+                          f"first was '{frame_filename}': {reason}")
+
+def open_gpu_decoder(video_path):
+    """
+    Opens the video with torchcodec's CUDA (NVDEC) decoder.
+
+    Returns:
+        VideoDecoder or None: None when torchcodec or CUDA is not available,
+                              when the decoder cannot be created on CUDA
+                              (e.g. a CPU-only torchcodec build), or when the
+                              container does not report its frame rate.
+    """
+    try:
+        import torch
+        from torchcodec.decoders import VideoDecoder
+    except ImportError:
+        return None
+    if not torch.cuda.is_available():
+        return None
+
+    try:
+        decoder = VideoDecoder(str(video_path), device="cuda")
+    except (RuntimeError, ValueError) as e:
+        print(f"GPU decoding unavailable ({e}), falling back to OpenCV.")
+        return None
+
+    if decoder.metadata.average_fps is None:
+        print("The video does not report its frame rate to torchcodec, falling back to OpenCV.")
+        return None
+    return decoder
+
+def extract_frames_gpu(decoder, output_folder, frame_rate=2, batch_size=16):
+    """
+    Extracts frames by decoding the video on the GPU (NVDEC) with torchcodec.
+    Only the kept frames are decoded in batches and copied back to the host,
+    while PNG encoding runs on a FrameWriter thread pool.
+
+    Returns:
+        int: Number of frames saved.
+
+    Raises:
+        RuntimeError: If the GPU fails to decode the video.
+    """
+    fps = decoder.metadata.average_fps
+    frame_interval = int(fps / frame_rate) if frame_rate > 0 else 1
+    indices = list(range(0, len(decoder), max(frame_interval, 1)))
+
+    writer = FrameWriter()
+    try:
+        for start in range(0, len(indices), batch_size):
+            batch = decoder.get_frames_at(indices=indices[start:start + batch_size])
+            # NCHW RGB on the GPU -> NHWC BGR on the host, as expected by OpenCV
+            frames = batch.data.permute(0, 2, 3, 1).flip(-1).contiguous().cpu().numpy()
+            for offset, frame in enumerate(frames):
+                writer.submit(output_folder / f"{start + offset:05d}.png", frame)
+    finally:
+        writer.close()
+
+    return len(indices)
+
 def extract_frames(video_path, output_folder, frame_rate=2):
     """
     Extracts frames from a video file at a specified frame rate.
+    Decoding happens on the GPU when torchcodec and CUDA are available,
+    otherwise it falls back to OpenCV on the CPU.
 
     Args:
         video_path (str): Path to the input video file.
@@ -13,36 +122,62 @@ def extract_frames(video_path, output_folder, frame_rate=2):
     """
     video_path = Path(video_path)
     output_folder = Path(output_folder)
-    
+
     if not video_path.exists():
         print(f"Error: Video file not found at {video_path}")
         return
 
     output_folder.mkdir(parents=True, exist_ok=True)
 
+    decoder = open_gpu_decoder(video_path)
+    if decoder is not None:
+        try:
+            saved_count = extract_frames_gpu(decoder, output_folder, frame_rate)
+        except RuntimeError as e:
+            # e.g. a codec NVDEC does not support; the CPU path rewrites all frames
+            print(f"GPU decoding failed ({e}), falling back to OpenCV.")
+        else:
+            print(f"Successfully extracted {saved_count} frames to {output_folder}")
+            return
+
     cap = cv2.VideoCapture(str(video_path))
     if not cap.isOpened():
         print("Error: Could not open video.")
         return
 
     fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_interval = int(fps / frame_rate) if frame_rate > 0 else 1
-    
-    frame_count = 0
+    frame_interval = max(int(fps / frame_rate), 1) if frame_rate > 0 else 1
+    use_seek = frame_interval >= SEEK_MIN_INTERVAL
+    # The frame count is only a container estimate, so it just bounds the
+    # seeks; stepping with grab() reads until the end of the video
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if use_seek and total_frames > 0:
+        targets = range(0, total_frames, frame_interval)
+    else:
+        targets = itertools.count(0, frame_interval)
+
+    writer = FrameWriter()
+    position = 0
     saved_count = 0
-    
-    while True:
+
+    for target in targets:
+        # Only the kept frames are converted to BGR and copied out
+        if use_seek and target > position:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        else:
+            while position < target and cap.grab():
+                position += 1
+
         ret, frame = cap.read()
         if not ret:
             break # End of video
+        position = target + 1
 
-        if frame_count % frame_interval == 0:
-            frame_filename = output_folder / f"{saved_count:05d}.png"
-            cv2.imwrite(str(frame_filename), frame)
-            saved_count += 1
-        
-        frame_count += 1
+        frame_filename = output_folder / f"{saved_count:05d}.png"
+        writer.submit(frame_filename, frame)
+        saved_count += 1
 
+    writer.close()
     cap.release()
     print(f"Successfully extracted {saved_count} frames to {output_folder}")
 
@@ -50,4 +185,4 @@ if __name__ == '__main__':
     VIDEO_FILE = 'data/video.mp4'
     FRAME_OUTPUT_DIR = 'data/frames'
     FRAMES_PER_SECOND = 1
-    extract_frames(VIDEO_FILE, FRAME_OUTPUT_DIR, FRAMES_PER_SECOND)
\ No newline at end of file
+    extract_frames(VIDEO_FILE, FRAME_OUTPUT_DIR, FRAMES_PER_SECOND)
@@ -1,48 +1,109 @@
 import torch
+from torch.utils.data import DataLoader, Dataset
 from transformers import AutoImageProcessor, Mask2FormerForUniversalSegmentation
 from PIL import Image
 from pathlib import Path
 from tqdm import tqdm
+from model_utils import inference_dtype, load_pretrained
 
-def segment_images(image_folder, output_folder):
+class ImageFolderDataset(Dataset):
+    """
+    Decodes the frames of a folder so a DataLoader can overlap PIL decoding
+    and preprocessing with GPU inference.
+    """
+    def __init__(self, image_files):
+        self.image_files = image_files
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def __getitem__(self, idx):
+        image_path = self.image_files[idx]
+        return image_path, Image.open(image_path).convert("RGB")
+
+class CollateImages:
+    """
+    Runs the image processor (resize, normalize, pad) on a batch of decoded
+    frames inside the DataLoader workers, so it overlaps with inference.
+    """
+    def __init__(self, processor):
+        self.processor = processor
+
+    def __call__(self, batch):
+        image_paths, images = zip(*batch)
+        target_sizes = [image.size[::-1] for image in images]
+        inputs = self.processor(images=list(images), return_tensors="pt")
+        return list(image_paths), target_sizes, dict(inputs)
+
+def segment_images(image_folder, output_folder, batch_size=8, num_workers=4, compile_model=False):
     """
     Runs semantic segmentation on all images in a folder and saves the results.
+
+    Args:
+        image_folder (str): Directory containing the input frames.
+        output_folder (str): Directory to save the segmentation masks.
+        batch_size (int): Number of frames passed through the model at once.
+        num_workers (int): Number of worker processes used to decode and
+                           preprocess frames.
+        compile_model (bool): Compile the model with torch.compile. This pays
+                              off when segmenting many frames in one run.
     """
     image_folder = Path(image_folder)
     output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    # Load the model and processor
-    processor = AutoImageProcessor.from_pretrained("facebook/mask2former-swin-tiny-coco-instance")
-    model = Mask2FormerForUniversalSegmentation.from_pretrained("facebook/mask2former-swin-tiny-coco-instance")
-    
     device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = inference_dtype(device)
+
+    # Load the model and processor
+    processor = load_pretrained(AutoImageProcessor, "facebook/mask2former-swin-tiny-coco-instance")
+    model = load_pretrained(Mask2FormerForUniversalSegmentation, "facebook/mask2former-swin-tiny-coco-instance", torch_dtype=dtype)
+
     model.to(device)
+    if device == "cuda":
+        model = model.to(memory_format=torch.channels_last)
+    model.eval()
+    if compile_model:
+        # Frame sizes may vary, so compile for dynamic shapes to avoid recompiles
+        model = torch.compile(model, mode="reduce-overhead", dynamic=True)
     print(f"Using device: {device}")
 
     image_files = sorted([f for f in image_folder.glob('*.png')])
+    loader = DataLoader(
+        ImageFolderDataset(image_files),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=CollateImages(processor),
+        pin_memory=device == "cuda",
+    )
+
+    with tqdm(total=len(image_files), desc="Segmenting images") as progress:
+        for image_paths, target_sizes, inputs in loader:
+            # Move the preprocessed batch to the device
+            inputs = {k: v.to(device, non_blocking=True) for k, v in inputs.items()}
+            if device == "cuda":
+                inputs["pixel_values"] = inputs["pixel_values"].to(memory_format=torch.channels_last, dtype=torch.float16)
+
+            # Perform inference
+            with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16, enabled=device == "cuda"):
+                outputs = model(**inputs)
+
+                # Post-process to get one semantic segmentation map per image
+                results = processor.post_process_semantic_segmentation(outputs, target_sizes=target_sizes)
+
+            for image_path, result in zip(image_paths, results):
+                # Save the result as a grayscale image
+                output_image = Image.fromarray(result.cpu().numpy().astype('uint8'))
+
+                output_filename = output_folder / f"{image_path.stem}_mask.png"
+                output_image.save(output_filename)
 
-    for image_path in tqdm(image_files, desc="Segmenting images"):
-        image = Image.open(image_path).convert("RGB")
-        
-        # Prepare inputs
-        inputs = processor(images=image, return_tensors="pt").to(device)
-
-        # Perform inference
-        with torch.no_grad():
-            outputs = model(**inputs)
-
-        # Post-process to get semantic segmentation map
-        result = processor.post_process_semantic_segmentation(outputs, target_sizes=[image.size[::-1]])[0]
-        
-        # Save the result as a grayscale image
-        output_image = Image.fromarray(result.cpu().numpy().astype('uint8'))
-        
-        output_filename = output_folder / f"{image_path.stem}_mask.png"
-        output_image.save(output_filename)
+            progress.update(len(image_paths))
 
 if __name__ == '__main__':
     FRAME_INPUT_DIR = 'data/frames'
     MASK_OUTPUT_DIR = 'data/masks'
+    # Compiling takes a while up front but speeds up long runs
+    COMPILE_MODEL = False
 
-    segment_images(FRAME_INPUT_DIR, MASK_OUTPUT_DIR)
\ No newline at end of file
+    segment_images(FRAME_INPUT_DIR, MASK_OUTPUT_DIR, compile_model=COMPILE_MODEL)
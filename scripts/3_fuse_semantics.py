@@ -1,20 +1,109 @@
+import cv2
+import json
 import numpy as np
 import open3d as o3d
 import pycolmap
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
-from collections import Counter
 import matplotlib.pyplot as plt
+from numba import njit, prange
 
-def fuse_semantics(colmap_path, masks_path, dense_ply_path, output_ply_path):
+@njit(parallel=True, fastmath=True, cache=True)
+def accumulate_view(points, intrinsics, R, t, mask, center, votes, cam_center_sum, view_count):
+    """
+    Projects every 3D point into one view and, for the points that land
+    inside the mask, adds a vote for the mask label and the camera center.
+    The view is given as pinhole intrinsics (fx, fy, cx, cy) and a
+    world-to-camera rotation and translation, so the projection is written
+    out with scalars instead of a generic K @ [R|t] product.
+    Each point only updates its own rows, so the loop needs no atomics and
+    allocates no intermediate arrays.
+    """
+    # The mask has the resolution of its camera, and bounding by its shape
+    # keeps the unchecked indexing below in range
+    h, w = mask.shape
+    for i in prange(points.shape[0]):
+        px, py, pz = points[i, 0], points[i, 1], points[i, 2]
+        # Skip points that are behind the camera (z <= 0)
+        z = R[2, 0] * px + R[2, 1] * py + R[2, 2] * pz + t[2]
+        if z <= 0:
+            continue
+        xc = R[0, 0] * px + R[0, 1] * py + R[0, 2] * pz + t[0]
+        yc = R[1, 0] * px + R[1, 1] * py + R[1, 2] * pz + t[1]
+        x = intrinsics[0] * xc / z + intrinsics[2]
+        y = intrinsics[1] * yc / z + intrinsics[3]
+        # Skip points outside the image boundaries
+        if x < 0 or x >= w or y < 0 or y >= h:
+            continue
+
+        label = mask[int(y), int(x)]
+        if label > 0: # Ignore background label (usually 0)
+            votes[i, label] += 1
+        for k in range(3):
+            cam_center_sum[i, k] += center[k]
+        view_count[i] += 1
+
+def colmap_model_key(colmap_path):
+    """
+    Identifies a COLMAP model by its resolved path and the latest
+    modification time of its files, for keying the cache.
+    """
+    colmap_path = Path(colmap_path)
+    return {
+        "colmap_path": str(colmap_path.resolve()),
+        "colmap_mtime_ns": max(f.stat().st_mtime_ns for f in colmap_path.iterdir()),
+    }
+
+def load_point_positions(sparse_points, colmap_path, cache_dir):
+    """
+    Converts the COLMAP points3D mapping into a contiguous (N, 3) float32 array.
+    The array cached in 'cache_dir' by a previous run is reused if it was
+    recorded for this same, unmodified COLMAP model.
+    """
+    cache_file = Path(cache_dir) / "points3D_xyz.npy"
+    source_file = Path(cache_dir) / "point_cloud_source.json"
+    if cache_file.exists() and source_file.exists():
+        with open(source_file) as f:
+            source = json.load(f)
+        key = colmap_model_key(colmap_path)
+        if all(source.get(k) == v for k, v in key.items()) and source.get("num_points") == len(sparse_points):
+            return np.load(cache_file)
+
+    points_3d = np.empty((len(sparse_points), 3), dtype=np.float32)
+    for row, point in enumerate(sparse_points.values()):
+        points_3d[row] = point.xyz
+    return points_3d
+
+def load_masks(masks_path, images):
+    """
+    Reads the semantic mask of every image that has one, decoding the PNGs
+    on a thread pool.
+
+    Returns:
+        dict: Maps each image id to its (H, W) uint8 label mask.
+    """
+    mask_files = {}
+    for image_id, image in images.items():
+        mask_file = masks_path / f"{Path(image.name).stem}_mask.png"
+        if mask_file.exists():
+            mask_files[image_id] = mask_file
+
+    with ThreadPoolExecutor() as pool:
+        masks = pool.map(lambda f: cv2.imread(str(f), cv2.IMREAD_UNCHANGED), mask_files.values())
+        return dict(zip(mask_files.keys(), masks))
+
+def fuse_semantics(colmap_path, masks_path, dense_ply_path, output_ply_path, cache_dir='cache'):
     """
     Fuses 2D semantic masks onto a 3D point cloud from COLMAP.
     This version is modified to work with the SPARSE point cloud from COLMAP,
     making it compatible with systems that do not have a CUDA-enabled GPU.
+    Intermediate arrays are cached in 'cache_dir' between runs.
     """
     colmap_path = Path(colmap_path)
     masks_path = Path(masks_path)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
     
     # --- 1. Validate Inputs and Load COLMAP Reconstruction ---
     print("Loading COLMAP model...")
@@ -42,67 +131,62 @@ def fuse_semantics(colmap_path, masks_path, dense_ply_path, output_ply_path):
         print("This indicates a failure in the 'colmap mapper' step.")
         return
 
-    # Convert sparse points to a NumPy array of XYZ coordinates
-    points_3d = np.array([p.xyz for p in sparse_points.values()])
+    # Convert sparse points to a contiguous float32 array of XYZ coordinates
+    points_3d = load_point_positions(sparse_points, colmap_path, cache_dir)
     num_points = len(points_3d)
     
     # --- 3. Initialize Data Structures ---
-    # We store a list of label "votes" for each 3D point
-    point_labels = [[] for _ in range(num_points)]
+    # We count the label "votes" for each 3D point (masks are uint8, so 256 classes)
+    votes = np.zeros((num_points, 256), dtype=np.uint32)
+    # Sum of the centers of the cameras that see each point, used to orient normals
+    cam_center_sum = np.zeros((num_points, 3), dtype=np.float64)
+    view_count = np.zeros(num_points, dtype=np.uint32)
 
     # --- 4. Project Points and Gather Labels from Each Image ---
+    print("Loading semantic masks...")
+    masks = load_masks(masks_path, images)
+
+    if not masks:
+        print(f"Error: No semantic masks matching the COLMAP images were found in '{masks_path}'")
+        return
+
     print("Projecting points and gathering labels...")
     for image_id, image in tqdm(images.items(), desc="Processing images"):
         cam = cameras[image.camera_id]
-        
-        # Load the corresponding semantic mask
-        mask_file = masks_path / f"{Path(image.name).stem}_mask.png"
-        if not mask_file.exists():
+
+        # Get the corresponding semantic mask
+        mask = masks.get(image_id)
+        if mask is None:
             continue
-        mask = np.array(Image.open(mask_file))
-        
-        # Manually construct the projection matrix P = K @ [R|t]
+
+        # Manually gather the pinhole parameters of P = K @ [R|t]
         # This is the most robust method across different pycolmap versions.
-        # 1. Get K, the camera intrinsics matrix
+        # 1. Get K, the camera intrinsics matrix (COLMAP models have no skew)
         K = cam.calibration_matrix()
+        intrinsics = np.array([K[0, 0], K[1, 1], K[0, 2], K[1, 2]])
         # 2. Get [R|t], the camera extrinsics matrix (world-to-camera)
         # Note the parentheses after cam_from_world() to call the method.
         Rt = image.cam_from_world().matrix()[:3, :]
-        proj_matrix = K @ Rt
+        R, t = np.ascontiguousarray(Rt[:, :3]), np.ascontiguousarray(Rt[:, 3])
+        # The camera center in world coordinates is -R^T @ t
+        center = -R.T @ t
 
-        # Project all 3D points into the current camera view
-        points_3d_homo = np.hstack((points_3d, np.ones((num_points, 1))))
-        points_2d_homo = (proj_matrix @ points_3d_homo.T).T
-        
-        # De-homogenize and filter out points that are behind the camera (z <= 0)
-        visible_mask = points_2d_homo[:, 2] > 0
-        points_2d = points_2d_homo[visible_mask, :2] / points_2d_homo[visible_mask, 2, np.newaxis]
-        
-        # Check which points are within the image boundaries
-        h, w = cam.height, cam.width
-        in_bounds_mask = (points_2d[:, 0] >= 0) & (points_2d[:, 0] < w) & \
-                         (points_2d[:, 1] >= 0) & (points_2d[:, 1] < h)
-        
-        # Get the 3D indices of points that are visible and in bounds
-        visible_3d_indices = np.where(visible_mask)[0][in_bounds_mask]
-        
-        # Get the 2D coordinates for these valid points
-        valid_2d_coords = points_2d[in_bounds_mask].astype(int)
-        
-        # Look up the semantic label for each valid point from the mask
-        for i, (x, y) in enumerate(valid_2d_coords):
-            point_3d_idx = visible_3d_indices[i]
-            label = mask[y, x]
-            if label > 0: # Ignore background label (usually 0)
-                point_labels[point_3d_idx].append(label)
+        # Project all 3D points into the current camera view and gather labels
+        accumulate_view(points_3d, intrinsics, R, t, mask, center, votes, cam_center_sum, view_count)
 
     # --- 5. Aggregate Labels for Each Point (Majority Vote) ---
     print("Aggregating labels...")
-    final_labels = np.zeros(num_points, dtype=int)
-    for i in range(num_points):
-        if point_labels[i]:
-            most_common = Counter(point_labels[i]).most_common(1)[0]
-            final_labels[i] = most_common[0]
+    # Column 0 (background) never receives votes, so unlabeled points resolve to 0
+    final_labels = votes.argmax(axis=1)
+
+    # Mean observing camera per point; points seen by no view fall back to the
+    # mean over all observations. Used for normal orientation in 5_create_mesh.py
+    seen = view_count > 0
+    camera_centers = None
+    if seen.any():
+        camera_centers = np.empty((num_points, 3), dtype=np.float32)
+        camera_centers[seen] = cam_center_sum[seen] / view_count[seen, np.newaxis]
+        camera_centers[~seen] = cam_center_sum.sum(axis=0) / view_count.sum()
 
     # --- 6. Create a Color Map for Visualization ---
     max_label = final_labels.max()
@@ -113,14 +197,41 @@ def fuse_semantics(colmap_path, masks_path, dense_ply_path, output_ply_path):
     else:
         colormap = plt.get_cmap("viridis", max_label + 1)
         point_colors = colormap(final_labels / max_label)[:, :3] # Get RGB
+    point_colors = np.ascontiguousarray(point_colors, dtype=np.float32)
 
     # --- 7. Create Final Point Cloud and Save ---
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(points_3d)
-    pcd.colors = o3d.utility.Vector3dVector(point_colors)
-    o3d.io.write_point_cloud(output_ply_path, pcd)
+    # The tensor point cloud keeps float32 positions instead of upcasting to
+    # float64. Colors are stored as uint8, since the legacy PLY reader used by
+    # the later steps expects 0-255 values.
+    pcd = o3d.t.geometry.PointCloud()
+    pcd.point.positions = o3d.core.Tensor.from_numpy(points_3d)
+    pcd.point.colors = o3d.core.Tensor.from_numpy((point_colors * 255).round().astype(np.uint8))
+    o3d.t.io.write_point_cloud(output_ply_path, pcd)
     print(f"Successfully saved semantic point cloud to {output_ply_path}")
 
+    # Cache the positions, colors and camera centers so later runs and stages
+    # can reuse them instead of converting the model or parsing the PLY. The
+    # source record is written last and ties the arrays to this COLMAP model
+    # and PLY file.
+    source_file = cache_dir / "point_cloud_source.json"
+    source_file.unlink(missing_ok=True)
+    np.save(cache_dir / "points3D_xyz.npy", points_3d)
+    np.save(cache_dir / "colors.npy", point_colors)
+    camera_centers_file = cache_dir / "camera_centers.npy"
+    if camera_centers is not None:
+        np.save(camera_centers_file, camera_centers)
+    else:
+        # Don't leave centers from an earlier run for 5_create_mesh.py to pick up
+        camera_centers_file.unlink(missing_ok=True)
+    source = {
+        **colmap_model_key(colmap_path),
+        "ply_path": str(Path(output_ply_path).resolve()),
+        "ply_mtime_ns": Path(output_ply_path).stat().st_mtime_ns,
+        "num_points": num_points,
+    }
+    with open(source_file, "w") as f:
+        json.dump(source, f)
+
 
 if __name__ == '__main__':
     # --- Configuration ---
@@ -129,6 +240,7 @@ if __name__ == '__main__':
     # DENSE_PLY_INPUT is no longer used in this version of the script.
     DENSE_PLY_INPUT = 'data/dense/fused.ply' # This path is now ignored.
     SEMANTIC_PLY_OUTPUT = 'results/semantic_scene.ply'
+    CACHE_DIR = 'cache'
     # ---------------------
 
-    fuse_semantics(COLMAP_MODEL_PATH, MASKS_INPUT_DIR, DENSE_PLY_INPUT, SEMANTIC_PLY_OUTPUT)
\ No newline at end of file
+    fuse_semantics(COLMAP_MODEL_PATH, MASKS_INPUT_DIR, DENSE_PLY_INPUT, SEMANTIC_PLY_OUTPUT, CACHE_DIR)
\ No newline at end of file
@@ -1,27 +1,100 @@
+import json
 import open3d as o3d
 import numpy as np
+from pathlib import Path
 
-def create_mesh_from_point_cloud(point_cloud_path, output_mesh_path, depth=8):
+def load_cached_point_cloud(point_cloud_path, cache_dir):
+    """
+    Builds the point cloud from the arrays cached by '3_fuse_semantics.py'
+    by memory-mapping them, which avoids parsing the PLY file. The cache is
+    only used if it was recorded for this exact PLY file and it has not
+    been modified since.
+
+    Returns:
+        o3d.t.geometry.PointCloud or None: None if no up-to-date cache exists.
+    """
+    points_file = Path(cache_dir) / "points3D_xyz.npy"
+    colors_file = Path(cache_dir) / "colors.npy"
+    source_file = Path(cache_dir) / "point_cloud_source.json"
+    ply_path = Path(point_cloud_path)
+    if not (points_file.exists() and colors_file.exists() and source_file.exists() and ply_path.exists()):
+        return None
+
+    with open(source_file) as f:
+        source = json.load(f)
+    if (source.get("ply_path") != str(ply_path.resolve())
+            or source.get("ply_mtime_ns") != ply_path.stat().st_mtime_ns):
+        return None
+
+    points = np.load(points_file, mmap_mode="r")
+    colors = np.load(colors_file, mmap_mode="r")
+    if not len(points) == len(colors) == source.get("num_points"):
+        return None
+
+    pcd_t = o3d.t.geometry.PointCloud()
+    pcd_t.point.positions = o3d.core.Tensor(points)
+    pcd_t.point.colors = o3d.core.Tensor(colors)
+    return pcd_t
+
+def create_mesh_from_point_cloud(point_cloud_path, output_mesh_path, depth=8, cache_dir='cache'):
     """
     Loads a point cloud, computes normals, and generates a mesh using
     Poisson surface reconstruction. It preserves the vertex colors.
+    Normals are flipped towards the cameras that observed each point when
+    '3_fuse_semantics.py' has saved them, which is much faster than
+    propagating a consistent orientation over the whole cloud.
 
     Args:
         point_cloud_path (str): Path to the input .ply point cloud file.
         output_mesh_path (str): Path to save the output .ply mesh file.
         depth (int): The depth of the octree used for reconstruction. Higher
                      values mean more detail but more memory usage.
+        cache_dir (str): Directory with the arrays cached by '3_fuse_semantics.py'
+                         (positions, colors and per-point camera centers).
     """
-    print(f"Loading point cloud from {point_cloud_path}...")
-    pcd = o3d.io.read_point_cloud(point_cloud_path)
+    # The tensor-based point cloud estimates normals on all CPU cores
+    pcd_t = load_cached_point_cloud(point_cloud_path, cache_dir)
+    from_cache = pcd_t is not None
+    if from_cache:
+        print(f"Loaded point cloud from the arrays cached in {cache_dir}")
+    else:
+        print(f"Loading point cloud from {point_cloud_path}...")
+        pcd_t = o3d.t.io.read_point_cloud(point_cloud_path)
 
-    if not pcd.has_points():
+    if pcd_t.is_empty():
         print("Error: The point cloud is empty. Cannot create a mesh.")
         return
 
     print("Estimating normals...")
-    pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.1, max_nn=30))
-    pcd.orient_normals_consistent_tangent_plane(100)
+    pcd_t.estimate_normals(max_nn=30, radius=0.1)
+
+    # The camera centers belong to the cached cloud, so they are only
+    # trusted when that cloud was accepted for this PLY file
+    camera_centers = None
+    camera_centers_path = Path(cache_dir) / "camera_centers.npy"
+    if not from_cache:
+        print("No cached point cloud matches this file, so its camera centers are unknown.")
+    elif not camera_centers_path.exists():
+        print(f"No camera centers found in {cache_dir}.")
+    else:
+        camera_centers = np.load(camera_centers_path, mmap_mode="r")
+
+    positions = pcd_t.point.positions.numpy()
+    if camera_centers is not None and len(camera_centers) != len(positions):
+        print(f"The camera centers in {cache_dir} do not match the point count, ignoring them.")
+        camera_centers = None
+
+    if camera_centers is not None:
+        # Flip every normal that points away from its observing cameras
+        normals = pcd_t.point.normals.numpy()
+        flip = (normals * (camera_centers - positions)).sum(axis=1) < 0
+        normals[flip] *= -1
+        pcd_t.point.normals = o3d.core.Tensor(normals)
+        pcd = pcd_t.to_legacy()
+    else:
+        print("Orienting normals from the point cloud instead...")
+        pcd = pcd_t.to_legacy()
+        pcd.orient_normals_consistent_tangent_plane(100)
 
     print(f"Creating mesh with Poisson reconstruction (depth={depth})...")
     mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
@@ -36,7 +109,8 @@ if __name__ == '__main__':
     # --- Configuration ---
     SEMANTIC_PLY_INPUT = 'results/semantic_scene.ply'
     SEMANTIC_MESH_OUTPUT = 'results/semantic_mesh.ply'
+    CACHE_DIR = 'cache'
     # ---------------------
 
-    create_mesh_from_point_cloud(SEMANTIC_PLY_INPUT, SEMANTIC_MESH_OUTPUT)
+    create_mesh_from_point_cloud(SEMANTIC_PLY_INPUT, SEMANTIC_MESH_OUTPUT, cache_dir=CACHE_DIR)
 
@@ -1,4 +1,5 @@
 import trimesh
+from trimesh.exchange.gltf import export_glb
 from pathlib import Path
 
 def convert_ply_to_glb(input_ply_path, output_glb_path):
@@ -21,7 +22,10 @@ def convert_ply_to_glb(input_ply_path, output_glb_path):
     mesh = trimesh.load(input_path, process=False)
 
     print(f"Converting and exporting to '{output_glb_path}'...")
-    mesh.export(output_glb_path, file_type='glb')
+    # Normals are left out, viewers recompute them from the triangles
+    glb_data = export_glb(mesh, include_normals=False)
+    with open(output_glb_path, 'wb') as f:
+        f.write(glb_data)
     print("Conversion successful! A valid .glb file has been created.")
 
 if __name__ == '__main__':
@@ -10,6 +10,8 @@ def main():
     asset_path = 'results/semantic_asset.glb'
     try:
         mesh = o3d.io.read_triangle_mesh(asset_path)
+        # The .glb is exported without normals, so derive them for lighting
+        mesh.compute_vertex_normals()
         print(f"Successfully loaded semantic asset from '{asset_path}'")
     except Exception as e:
         print(f"Error: Could not load asset from '{asset_path}'. {e}")
@@ -31,6 +33,13 @@ def main():
     character_transform = np.eye(4)
     character_transform[2, 3] = -1.0 # Start at z = -1
 
+    # Collision rays are cast from several heights above the character's
+    # position (feet, body, head). The ray buffer is allocated once and the
+    # tensor shares its memory, so each step only updates it in place.
+    ray_heights = np.array([0.05, 0.1, 0.15], dtype=np.float32)
+    rays_np = np.zeros((len(ray_heights), 6), dtype=np.float32)
+    rays = o3d.core.Tensor.from_numpy(rays_np)
+
     # --- 4. Set up the Visualizer and State ---
     vis = o3d.visualization.VisualizerWithKeyCallback()
     vis.create_window("Interactive Semantic Viewer", width=1280, height=720)
@@ -59,15 +68,16 @@ def main():
         next_pos = current_pos + forward_vector * step_size
 
         # --- Raycast to check for collisions ---
-        # Create a ray from slightly above the current position to the next position
-        ray_origin = current_pos + np.array([0, 0.1, 0]) # Start ray slightly above ground
-        ray = o3d.core.Tensor([ray_origin], dtype=o3d.core.Dtype.Float32)
-        
-        # Cast the ray and get the result
-        ans = scene.cast_rays(ray, direction=o3d.core.Tensor([forward_vector], dtype=o3d.core.Dtype.Float32))
-        
-        # Get the distance to the first hit
-        hit_distance = ans['t_hit'].numpy()[0]
+        # Create rays from slightly above the current position towards the next position
+        rays_np[:, :3] = current_pos
+        rays_np[:, 1] += ray_heights # Start rays above ground
+        rays_np[:, 3:] = forward_vector
+
+        # Cast all rays in a single call
+        ans = scene.cast_rays(rays)
+
+        # Get the distance to the closest hit over all rays
+        hit_distance = ans['t_hit'].numpy().min()
 
         # --- Make a decision based on the collision ---
         # If the wall is too close (less than our step size), don't move.
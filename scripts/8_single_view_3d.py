@@ -2,66 +2,91 @@ import torch
 import open3d as o3d
 import numpy as np
 from PIL import Image
+from pathlib import Path
+from tqdm import tqdm
+from model_utils import inference_dtype, load_pretrained
 from transformers import DPTForDepthEstimation, DPTImageProcessor
 
-def create_3d_from_single_image(image_path, output_ply_path):
+def load_depth_model(compile_model=False):
     """
-    Creates a 3D point cloud from a single 2D image using an AI depth estimation model.
+    Loads the DPT depth estimation model and its processor onto the best
+    available device.
 
-    Args:
-        image_path (str): Path to the input color image.
-        output_ply_path (str): Path to save the resulting .ply point cloud.
+    Returns:
+        tuple: (model, processor, device)
     """
-    # --- 1. Load the AI Model and Processor ---
     print("Loading AI depth estimation model (MiDaS)...")
     # This model is trained to predict depth from a single image.
-    model = DPTForDepthEstimation.from_pretrained("Intel/dpt-large")
-    processor = DPTImageProcessor.from_pretrained("Intel/dpt-large")
     device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = inference_dtype(device)
+    model = load_pretrained(DPTForDepthEstimation, "Intel/dpt-large", torch_dtype=dtype)
+    processor = load_pretrained(DPTImageProcessor, "Intel/dpt-large")
     model.to(device)
+    if device == "cuda":
+        model = model.to(memory_format=torch.channels_last)
+    model.eval()
+    if compile_model:
+        model = torch.compile(model, mode="reduce-overhead")
     print(f"Using device: {device}")
+    return model, processor, device
 
-    # --- 2. Load and Process the Image ---
-    try:
-        color_image = Image.open(image_path).convert("RGB")
-    except FileNotFoundError:
-        print(f"Error: Input image not found at '{image_path}'")
-        return
+def predict_depth_maps(model, processor, device, color_images):
+    """
+    Predicts a depth map for each image in one batched forward pass.
 
-    width, height = color_image.size
-    
-    # Prepare the image for the model
-    inputs = processor(images=color_image, return_tensors="pt").to(device)
+    Returns:
+        list: One float32 depth map per image, at the image's resolution,
+              inverted so that closer objects have smaller Z values.
+    """
+    # Prepare the images for the model (DPT resizes them to a common size)
+    inputs = processor(images=color_images, return_tensors="pt").to(device)
+    if device == "cuda":
+        inputs["pixel_values"] = inputs["pixel_values"].to(memory_format=torch.channels_last, dtype=torch.float16)
 
-    # --- 3. Predict the Depth Map ---
-    print("Predicting depth from the image...")
-    with torch.no_grad():
+    with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16, enabled=device == "cuda"):
         outputs = model(**inputs)
-        predicted_depth = outputs.predicted_depth
-
-    # Interpolate the depth map to the original image size
-    prediction = torch.nn.functional.interpolate(
-        predicted_depth.unsqueeze(1),
-        size=color_image.size[::-1],
-        mode="bicubic",
-        align_corners=False,
-    )
-    depth_map = prediction.squeeze().cpu().numpy()
-    
-    # Invert the depth map so that closer objects have smaller Z values
-    depth_map = np.max(depth_map) - depth_map
+        # Back to fp32 before inverting so the subtraction keeps full range
+        predicted_depth = outputs.predicted_depth.float() # (B, H', W')
+
+        # Invert each depth map on the device so that closer objects have
+        # smaller Z values, before upsampling it
+        predicted_depth = predicted_depth.amax(dim=(1, 2), keepdim=True) - predicted_depth
+
+        # Interpolate the depth maps to the original image sizes. Bicubic
+        # overshoot can dip slightly below zero, so clamp to valid depths
+        sizes = [image.size[::-1] for image in color_images]
+        if len(set(sizes)) == 1:
+            predictions = torch.nn.functional.interpolate(
+                predicted_depth.unsqueeze(1),
+                size=sizes[0],
+                mode="bicubic",
+                align_corners=False,
+            ).squeeze(1).clamp_(min=0)
+            # Onto the host in a single transfer
+            return list(predictions.cpu().numpy())
+
+        depth_maps = []
+        for depth, size in zip(predicted_depth, sizes):
+            prediction = torch.nn.functional.interpolate(
+                depth[None, None], size=size, mode="bicubic", align_corners=False
+            )[0, 0].clamp_(min=0)
+            depth_maps.append(prediction.cpu().numpy())
+        return depth_maps
+
+def depth_to_point_cloud(color_image, depth_map):
+    """
+    Unprojects a color image and its depth map into a colored point cloud.
+    """
+    width, height = color_image.size
 
-    # --- 4. Unproject to a 3D Point Cloud ---
-    print("Creating 3D point cloud from color and depth images...")
-    
     # Convert the color image to a NumPy array for color mapping
     color_data = np.array(color_image)
-    
+
     # Create an Open3D RGBDImage from the color and depth data
     # We need to convert our numpy arrays to Open3D Image types
     o3d_color = o3d.geometry.Image(color_data)
     o3d_depth = o3d.geometry.Image(depth_map)
-    
+
     rgbd_image = o3d.geometry.RGBDImage.create_from_color_and_depth(
         o3d_color, o3d_depth, depth_scale=1.0, depth_trunc=1000.0, convert_rgb_to_intensity=False
     )
@@ -77,18 +102,86 @@ def create_3d_from_single_image(image_path, output_ply_path):
 
     # The default orientation is often sideways, so we rotate it for better viewing
     pcd.transform([[1, 0, 0, 0], [0, -1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]])
+    return pcd
+
+def create_3d_from_single_image(image_path, output_ply_path, compile_model=False):
+    """
+    Creates a 3D point cloud from a single 2D image using an AI depth estimation model.
+
+    Args:
+        image_path (str): Path to the input color image.
+        output_ply_path (str): Path to save the resulting .ply point cloud.
+        compile_model (bool): Compile the model with torch.compile.
+    """
+    # --- 1. Load the AI Model and Processor ---
+    model, processor, device = load_depth_model(compile_model)
+
+    # --- 2. Load the Image ---
+    try:
+        color_image = Image.open(image_path).convert("RGB")
+    except FileNotFoundError:
+        print(f"Error: Input image not found at '{image_path}'")
+        return
+
+    # --- 3. Predict the Depth Map ---
+    print("Predicting depth from the image...")
+    depth_map = predict_depth_maps(model, processor, device, [color_image])[0]
+
+    # --- 4. Unproject to a 3D Point Cloud ---
+    print("Creating 3D point cloud from color and depth images...")
+    pcd = depth_to_point_cloud(color_image, depth_map)
 
     # --- 5. Save and Visualize ---
     print(f"Saving point cloud to '{output_ply_path}'...")
     o3d.io.write_point_cloud(output_ply_path, pcd)
-    
+
     print("Displaying the 3D point cloud. Close the window to exit.")
     o3d.visualization.draw_geometries([pcd])
 
+def create_3d_from_images(image_folder, output_folder, batch_size=8, compile_model=False):
+    """
+    Creates one 3D point cloud per image in a folder. The model is loaded once
+    and the frames go through it in batches.
+
+    Args:
+        image_folder (str): Directory containing the input color images.
+        output_folder (str): Directory to save the resulting .ply point clouds.
+        batch_size (int): Number of images passed through the model at once.
+        compile_model (bool): Compile the model with torch.compile.
+    """
+    image_files = sorted(Path(image_folder).glob('*.png'))
+    if not image_files:
+        print(f"Error: No .png images found in '{image_folder}'")
+        return
+
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    model, processor, device = load_depth_model(compile_model)
+
+    for start in tqdm(range(0, len(image_files), batch_size), desc="Predicting depth"):
+        batch_files = image_files[start:start + batch_size]
+        color_images = [Image.open(f).convert("RGB") for f in batch_files]
+        depth_maps = predict_depth_maps(model, processor, device, color_images)
+
+        # Open3D has no batched RGBD unprojection, so build the clouds one by one
+        for image_path, color_image, depth_map in zip(batch_files, color_images, depth_maps):
+            pcd = depth_to_point_cloud(color_image, depth_map)
+            o3d.io.write_point_cloud(str(output_folder / f"{image_path.stem}.ply"), pcd)
+
+    print(f"Saved {len(image_files)} point clouds to '{output_folder}'")
+
 if __name__ == "__main__":
     # --- Configuration ---
-    # Use one of the frames you extracted earlier
+    # Use one of the frames you extracted earlier, or point this at a folder
+    # (e.g. 'data/frames') to process every frame in batches
     INPUT_IMAGE_PATH = 'data/frames/00001.png'
     OUTPUT_PLY_PATH = 'results/single_view_3d.ply'
+    OUTPUT_BATCH_DIR = 'results/single_view_3d'
+    # Compiling takes a while up front, so it mostly pays off for folders
+    COMPILE_MODEL = False
     # ---------------------
-    create_3d_from_single_image(INPUT_IMAGE_PATH, OUTPUT_PLY_PATH)
\ No newline at end of file
+    if Path(INPUT_IMAGE_PATH).is_dir():
+        create_3d_from_images(INPUT_IMAGE_PATH, OUTPUT_BATCH_DIR, compile_model=COMPILE_MODEL)
+    else:
+        create_3d_from_single_image(INPUT_IMAGE_PATH, OUTPUT_PLY_PATH, compile_model=COMPILE_MODEL)
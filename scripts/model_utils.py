@@ -0,0 +1,19 @@
+import torch
+
+def load_pretrained(cls, name, **kwargs):
+    """
+    Loads a Hugging Face checkpoint from the local cache, downloading it only
+    when it has not been fetched before.
+    """
+    try:
+        return cls.from_pretrained(name, local_files_only=True, **kwargs)
+    except OSError:
+        return cls.from_pretrained(name, **kwargs)
+
+def inference_dtype(device):
+    """
+    Returns the dtype to load model weights in for the given device.
+    Half precision weights let the convolutions run on tensor cores; CPU
+    inference stays in fp32.
+    """
+    return torch.float16 if device == "cuda" else torch.float32